@@ -38,8 +38,7 @@ def main():
         print()
         print("# Optional")
         print("MIN_SCORE=90")
-        print("FASTAPI_HOST=127.0.0.1")
-        print("FASTAPI_PORT=8000")
+        print("LOG_LEVEL=INFO")
         print()
         print("💡 Get a free Groq API key from: https://console.groq.com")
         print("💡 Get 42crunch token from: https://42crunch.com")
@@ -75,7 +74,7 @@ def main():
             print("\n🎉 FastAPI project analysis complete!")
             print("📁 Check your project directory for:")
             print("   📋 security_improvements.md - Implementation guide")
-            print("   📄 openapi_improved.yaml - Enhanced OpenAPI spec")
+            print("   📄 openapi_improved.json - Enhanced OpenAPI spec")
         else:
             print("\n🎉 OpenAPI file enhancement complete!")
             print("📄 Improved spec saved with backup")
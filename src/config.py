@@ -0,0 +1,33 @@
+import logging
+import os
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Agent settings, read from the environment once at startup"""
+
+    c42_token: str = field(repr=False)  # Keep secrets out of debug output
+    groq_key: str = field(repr=False)
+    min_score: int
+    spec_path: str
+    log_level: str
+    audit_image_ready: bool = False  # Set by runner.main after the Docker check
+
+    @classmethod
+    def from_env(cls):
+        """Build the config from environment variables (call after load_dotenv)"""
+        log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+        if log_level not in logging.getLevelNamesMapping():
+            logging.getLogger("nemesis").warning(
+                "⚠️  Unknown LOG_LEVEL %r, using INFO", log_level
+            )
+            log_level = "INFO"
+
+        return cls(
+            c42_token=os.getenv("C42_TOKEN", ""),
+            groq_key=os.getenv("GROQ_API_KEY", ""),
+            min_score=int(os.getenv("MIN_SCORE", 90)),
+            spec_path=os.getenv("SPEC_PATH", "./sample_api.yaml"),
+            log_level=log_level,
+        )
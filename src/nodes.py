@@ -1,12 +1,289 @@
+import asyncio
+import hashlib
+import heapq
 import json
+import logging
 import os
 import pathlib
-import subprocess
+import shutil
+from collections import ChainMap
+from functools import lru_cache
 
 import jsonpatch
+import orjson
 import yaml
 from groq import Groq
-from pocketflow import Node
+from pocketflow import AsyncNode, Node
+
+try:
+    import re2 as _re  # google-re2: same API, linear-time DFA matching
+except ImportError:
+    import re as _re
+
+try:
+    from yaml import CSafeDumper as _YDumper
+    from yaml import CSafeLoader as _YLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeDumper as _YDumper
+    from yaml import SafeLoader as _YLoader
+
+log = logging.getLogger("nemesis")
+
+# Official 42crunch audit image, pulled once at startup by runner.main
+DOCKER_IMAGE = "42crunch/docker-api-security-audit:v4"
+
+# JSON Patch array inside a code fence (the closing fence may be cut off by streaming)
+_FENCED_PATCH_RE = _re.compile(r"(?s)```(?:json)?\s*(\[.*?\])\s*(?:```|$)")
+_JSON_DECODER = json.JSONDecoder()
+
+_SYSTEM_PROMPT = "You are an OpenAPI security expert. Return only valid JSON Patch operations, no explanations."
+
+# Static tail of the patch-planning prompt, appended after the spec and findings
+_PATCH_INSTRUCTIONS = """
+Generate a JSON Patch (RFC 6902) to fix these security issues. Common fixes include:
+- Adding security schemes (Bearer tokens, API keys)
+- Adding parameter validation (type, format, maxLength, etc.)
+- Adding proper response schemas
+- Adding rate limiting info
+- Fixing missing error responses
+
+Return ONLY a valid JSON Patch array, no explanations:
+[
+  {"op": "add", "path": "/security", "value": [{"bearerAuth": []}]},
+  {"op": "add", "path": "/components/securitySchemes", "value": {"bearerAuth": {"type": "http", "scheme": "bearer"}}}
+]"""
+
+
+@lru_cache(maxsize=8)
+def _load_openapi_json(path_str: str, mtime: float):
+    """Read an openapi.json file as indented JSON text, cached per (path, mtime)"""
+    openapi_spec = orjson.loads(pathlib.Path(path_str).read_bytes())
+    return orjson.dumps(openapi_spec, option=orjson.OPT_INDENT_2).decode()
+
+
+@lru_cache(maxsize=1)
+def _groq_client(api_key: str):
+    """Shared Groq client, so its HTTP connection pool is reused across iterations"""
+    return Groq(api_key=api_key)
+
+
+@lru_cache(maxsize=1)
+def _warm_up_groq(api_key: str):
+    """Open the Groq client's connection early; only the first call does any work"""
+    try:
+        _groq_client(api_key).models.list()
+    except Exception as e:
+        log.warning("⚠️  Groq warm-up failed: %s", e)
+
+
+def _start_groq_warm_up(api_key: str):
+    """Warm up Groq in the background while an audit subprocess runs
+
+    The client is built here on the loop thread, so the LLM node can never race
+    the worker into constructing a second one. Nothing awaits the warm-up.
+    """
+    _groq_client(api_key)
+    asyncio.get_running_loop().run_in_executor(None, _warm_up_groq, api_key)
+
+
+def _is_array_index(token: str):
+    """RFC 6901 array index: ASCII digits without leading zeros"""
+    return token.isascii() and token.isdigit() and (token == "0" or token[0] != "0")
+
+
+def _apply_simple_op(doc, op):
+    """Apply an add/replace/remove op by mutating its parent container directly
+
+    Returns False (leaving doc untouched) when the op is anything else or its
+    path does not resolve cleanly, so the caller can defer to jsonpatch.
+    """
+    kind, path = op.get("op"), op.get("path")
+    if kind not in ("add", "replace", "remove") or not path or path[0] != "/":
+        return False
+    if kind != "remove" and "value" not in op:
+        return False
+
+    *parents, last = [
+        token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")
+    ]
+    parent = doc
+    for token in parents:
+        if isinstance(parent, dict) and token in parent:
+            parent = parent[token]
+        elif (
+            isinstance(parent, list)
+            and _is_array_index(token)
+            and int(token) < len(parent)
+        ):
+            parent = parent[int(token)]
+        else:
+            return False
+
+    if isinstance(parent, dict):
+        if kind == "add":
+            parent[last] = op["value"]
+        elif last not in parent:
+            return False
+        elif kind == "replace":
+            parent[last] = op["value"]
+        else:
+            del parent[last]
+    elif isinstance(parent, list):
+        if kind == "add" and last == "-":
+            parent.append(op["value"])
+        elif not _is_array_index(last):
+            return False
+        elif kind == "add":
+            if int(last) > len(parent):
+                return False
+            parent.insert(int(last), op["value"])
+        elif int(last) >= len(parent):
+            return False
+        elif kind == "replace":
+            parent[int(last)] = op["value"]
+        else:
+            del parent[int(last)]
+    else:
+        return False
+    return True
+
+
+def _apply_patch_ops(doc, patch_ops):
+    """Apply JSON Patch ops to doc in place, returning the (possibly new) root
+
+    Common ops walk straight to their parent container; move/copy/test, root
+    paths and anything that fails to resolve go through jsonpatch, which also
+    raises the proper conflict errors.
+    """
+    for op in patch_ops:
+        if not _apply_simple_op(doc, op):
+            doc = jsonpatch.apply_patch(doc, [op], in_place=True)
+    return doc
+
+
+def _spec_digest(spec_dict):
+    """Content hash of a parsed spec, independent of key order"""
+    canonical = orjson.dumps(
+        spec_dict, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+    )
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+
+def _extract_patch_json(text: str):
+    """Pull the JSON Patch array out of an LLM reply
+
+    A fenced array wins, so brackets in surrounding prose are ignored:
+
+    >>> _extract_patch_json(
+    ...     'Here is the JSON Patch [RFC 6902] to apply:\\n```json\\n'
+    ...     '[{"op": "remove", "path": "/x"}]\\n```'
+    ... )
+    '[{"op": "remove", "path": "/x"}]'
+    >>> _extract_patch_json('Sure: [{"op": "remove", "path": "/x"}] done')
+    '[{"op": "remove", "path": "/x"}]'
+
+    Unfenced, the first "[" that decodes to a non-empty list of objects wins:
+
+    >>> _extract_patch_json(
+    ...     'Setting security to [] disables auth. Fix:\\n'
+    ...     '[{"op": "remove", "path": "/x"}]'
+    ... )
+    '[{"op": "remove", "path": "/x"}]'
+    """
+    match = _FENCED_PATCH_RE.search(text)
+    if match:
+        return match.group(1)
+
+    start = text.find("[")
+    while start != -1:
+        try:
+            value, end = _JSON_DECODER.raw_decode(text, start)
+        except json.JSONDecodeError:
+            pass
+        else:
+            if isinstance(value, list) and value:
+                if all(isinstance(op, dict) for op in value):
+                    return text[start:end]
+        start = text.find("[", start + 1)
+    return text
+
+
+def _read_patch_stream(stream):
+    """Collect a streamed completion, stopping once a fenced JSON array closes
+
+    Depth tracking starts only at a "[" that opens an array (next non-space
+    char is "{" or "]"), so brackets in prose such as "[RFC 6902]" are ignored.
+    An unfenced array does not end the stream, since a fenced patch may still
+    follow; without a fence the full reply is returned for _extract_patch_json.
+    """
+    text = ""
+    pos = 0  # Next unscanned index into text
+    fenced = False
+    depth = 0
+    in_string = escaped = False
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            text += chunk.choices[0].delta.content or ""
+            while pos < len(text):
+                ch = text[pos]
+                if depth == 0:
+                    if text.startswith("`", pos) and len(text) - pos < 3:
+                        break  # Wait for the rest of a possible fence
+                    if text.startswith("```", pos):
+                        fenced = True
+                        pos += 3
+                        continue
+                    if ch == "[":
+                        rest = text[pos + 1 :].lstrip()
+                        if not rest:
+                            break  # Wait for the char that decides it
+                        if rest[0] in "{]":
+                            depth = 1
+                elif in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = True
+                elif ch == "[":
+                    depth += 1
+                elif ch == "]":
+                    depth -= 1
+                    if depth == 0 and fenced:
+                        return text[: pos + 1]
+                pos += 1
+        return text
+    finally:
+        # Don't wait for trailing prose/fences once the array is complete
+        stream.close()
+
+
+def save_final_spec(shared):
+    """Write the improved spec back to a direct spec file, once per run
+
+    The original is copied to a backup, then the new text goes to a temp file
+    and is swapped in with a single os.replace, so the spec path always holds
+    either the old or the new spec.
+    """
+    new_text = shared.get("final_spec_text")
+    if new_text is None:
+        return
+
+    spec_path = pathlib.Path(shared["config"].spec_path)
+    backup_path = spec_path.with_suffix(f"{spec_path.suffix}.backup")
+    tmp_path = spec_path.with_suffix(f"{spec_path.suffix}.tmp")
+
+    shutil.copy2(spec_path, backup_path)  # Overwrites any old backup
+    tmp_path.write_text(new_text, encoding="utf-8")
+    os.replace(tmp_path, spec_path)
+
+    log.info("✅ Applied patch to %s", spec_path)
+    log.info("📁 Backup saved as %s", backup_path)
 
 
 class LoadSpec(Node):
@@ -28,26 +305,33 @@ class LoadSpec(Node):
 
         # Case 1: Direct OpenAPI file (YAML/JSON)
         if target_path.is_file() and target_path.suffix in [".yaml", ".yml", ".json"]:
-            print(f"📄 Loading spec from file: {path}")
-            return target_path.read_text(), "file", str(target_path)
+            log.info("📄 Loading spec from file: %s", path)
+            spec_text = target_path.read_text(encoding="utf-8")
+            if target_path.suffix == ".json":
+                spec_dict, spec_format = orjson.loads(spec_text), "json"
+            else:
+                spec_dict, spec_format = yaml.load(spec_text, Loader=_YLoader), "yaml"
+            return spec_dict, spec_text, spec_format, "file", str(target_path)
 
-        # Case 2: FastAPI project directory
+        # Case 2: FastAPI project directory (kept as JSON end-to-end)
         elif target_path.is_dir():
-            result = self._load_from_fastapi_project(target_path)
-            return result, "fastapi", str(target_path)
+            spec_dict, spec_text = self._load_from_fastapi_project(target_path)
+            return spec_dict, spec_text, "json", "fastapi", str(target_path)
 
         else:
             raise FileNotFoundError(f"Path not found or unsupported: {path}")
 
     def post(self, shared, prep_result, exec_result):
         """Store metadata in shared state"""
-        spec_text, source_type, source_path = exec_result
+        spec_dict, spec_text, spec_format, source_type, source_path = exec_result
 
         # Convert shared to dict if it's not already
         if not isinstance(shared, dict):
             shared = {}
 
+        shared["spec_dict"] = spec_dict
         shared["spec_text"] = spec_text
+        shared["spec_format"] = spec_format
         shared["source_type"] = source_type
         shared["source_path"] = source_path
 
@@ -58,7 +342,7 @@ class LoadSpec(Node):
 
     def _load_from_fastapi_project(self, project_dir: pathlib.Path):
         """Load OpenAPI spec from openapi.json file in FastAPI project directory"""
-        print(f"🚀 Loading FastAPI project from: {project_dir}")
+        log.info("🚀 Loading FastAPI project from: %s", project_dir)
 
         # Look for openapi.json file
         openapi_file = project_dir / "openapi.json"
@@ -70,18 +354,22 @@ class LoadSpec(Node):
                 f"You can generate it by running your FastAPI app and visiting /openapi.json endpoint."
             )
 
-        print(f"📄 Found OpenAPI spec file: {openapi_file}")
+        log.info("📄 Found OpenAPI spec file: %s", openapi_file)
 
         try:
-            # Read and parse the OpenAPI JSON file
-            openapi_content = openapi_file.read_text()
-            openapi_spec = json.loads(openapi_content)
-
-            print("📊 OpenAPI spec info:")
-            print(f"   Title: {openapi_spec.get('info', {}).get('title', 'N/A')}")
-            print(f"   Version: {openapi_spec.get('info', {}).get('version', 'N/A')}")
-            print(f"   Paths: {len(openapi_spec.get('paths', {}))}")
-            print(f"   File size: {len(openapi_content)} characters")
+            # Read and parse the OpenAPI JSON file (cached until it changes)
+            stat = openapi_file.stat()
+            json_spec = _load_openapi_json(str(openapi_file), stat.st_mtime)
+            # Parsed once per call; WritePatch mutates this dict in place
+            openapi_spec = orjson.loads(json_spec)
+
+            log.info("📊 OpenAPI spec info:")
+            log.info("   Title: %s", openapi_spec.get("info", {}).get("title", "N/A"))
+            log.info(
+                "   Version: %s", openapi_spec.get("info", {}).get("version", "N/A")
+            )
+            log.info("   Paths: %s", len(openapi_spec.get("paths", {})))
+            log.info("   File size: %s bytes", stat.st_size)
 
             # Store metadata for later use in post method
             self._fastapi_metadata = {
@@ -89,95 +377,107 @@ class LoadSpec(Node):
                 "openapi_file": str(openapi_file),
             }
 
-            # Convert to YAML string for consistency with the rest of the pipeline
-            yaml_spec = yaml.safe_dump(
-                openapi_spec, sort_keys=False, default_flow_style=False
-            )
-            print(f"📝 Converted to YAML ({len(yaml_spec)} characters)")
-            return yaml_spec
+            return openapi_spec, json_spec
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in {openapi_file}: {e}")
         except Exception as e:
             raise RuntimeError(f"Error reading {openapi_file}: {e}")
 
 
-class Audit42C(Node):
-    def exec(self, load_result):
-        """Run 42crunch security audit on OpenAPI spec"""
-        # Handle the new tuple format from LoadSpec
-        if isinstance(load_result, tuple):
-            spec_text = load_result[0]  # Extract just the spec text
-        else:
-            spec_text = load_result  # Fallback for backward compatibility
+class Audit42C(AsyncNode):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Reports keyed by spec content hash, so unchanged specs skip the audit
+        self._audit_cache: dict[bytes, dict] = {}
+        # Environment for the 42c-audit CLI, filled in once on first use
+        self._audit_env: dict[str, str] = {}
 
-        print("🔍 Running 42crunch security audit...")
+    async def prep_async(self, shared):
+        return shared["spec_text"], shared["config"]
 
+    async def exec_async(self, inputs):
+        """Run 42crunch security audit on OpenAPI spec"""
+        spec_text, config = inputs
+        # Encode once: the bytes feed both the cache key and the CLI's stdin
+        spec_bytes = spec_text.encode()
+        cache_key = hashlib.blake2b(spec_bytes, digest_size=16).digest()
+        if cache_key in self._audit_cache:
+            log.info("♻️  Spec unchanged since last audit - reusing cached report")
+            return self._audit_cache[cache_key], spec_text
+
+        log.info("🔍 Running 42crunch security audit...")
+        return await self._run_audit(spec_text, spec_bytes, cache_key, config)
+
+    async def _run_audit(self, spec_text, spec_bytes, cache_key, config):
+        """Run the audit with the local CLI, Docker, or the mock fallback"""
         # Check if 42c-audit CLI is available locally first
         import shutil
 
         if shutil.which("42c-audit"):
-            print("🔧 Using local 42c-audit CLI")
-            return self._run_local_audit(spec_text)
+            log.info("🔧 Using local 42c-audit CLI")
+            return await self._run_local_audit(spec_text, spec_bytes, cache_key, config)
 
         # Check if Docker is available
         if not shutil.which("docker"):
-            print("⚠️  Docker not found - using mock audit mode")
+            log.warning("⚠️  Docker not found - using mock audit mode")
             return self._mock_audit_report(), spec_text
 
-        print("🐳 Using Docker-based 42crunch audit")
-        return self._run_docker_audit(spec_text)
+        log.info("🐳 Using Docker-based 42crunch audit")
+        return await self._run_docker_audit(spec_text, cache_key, config)
 
-    def _run_local_audit(self, spec_text):
+    async def _run_local_audit(self, spec_text, spec_bytes, cache_key, config):
         """Run audit using local 42c-audit CLI"""
+        if not self._audit_env:
+            # Updated in place so the shallow node copies PocketFlow makes share it
+            self._audit_env.update(os.environ, C42_TOKEN=config.c42_token)
+
+        _start_groq_warm_up(config.groq_key)
         try:
-            p = subprocess.run(
-                ["42c-audit", "--output", "json", "-"],
-                input=spec_text,
-                text=True,
-                capture_output=True,
-                env={**os.environ, "C42_TOKEN": os.getenv("C42_TOKEN")},
+            p = await asyncio.create_subprocess_exec(
+                "42c-audit",
+                "--output",
+                "json",
+                "-",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._audit_env,
             )
+            stdout, stderr = await p.communicate(spec_bytes)
             if p.returncode != 0:
-                print(f"❌ 42c-audit stderr: {p.stderr}")
-                print("⚠️  Falling back to mock audit mode")
+                log.error("❌ 42c-audit stderr: %s", stderr.decode(errors="replace"))
+                log.warning("⚠️  Falling back to mock audit mode")
                 return self._mock_audit_report(), spec_text
 
-            report = json.loads(p.stdout)
+            report = orjson.loads(stdout)
             score = report.get("score", 0)
             findings_count = len(report.get("findings", []))
 
-            print(f"📊 Audit Score: {score}/100")
-            print(f"🔍 Found {findings_count} security issues")
+            log.info("📊 Audit Score: %s/100", score)
+            log.info("🔍 Found %s security issues", findings_count)
 
+            self._audit_cache[cache_key] = report
             return report, spec_text
         except (
-            subprocess.CalledProcessError,
             FileNotFoundError,
-            json.JSONDecodeError,
+            orjson.JSONDecodeError,
         ) as e:
-            print(f"❌ Local audit failed: {e}")
-            print("⚠️  Falling back to mock audit mode")
+            log.error("❌ Local audit failed: %s", e)
+            log.warning("⚠️  Falling back to mock audit mode")
             return self._mock_audit_report(), spec_text
 
-    def _run_docker_audit(self, spec_text):
+    async def _run_docker_audit(self, spec_text, cache_key, config):
         """Run audit using 42crunch Docker image"""
         try:
-            # Use the official 42crunch audit Docker image
-            docker_image = "42crunch/docker-api-security-audit:v4"
-
-            print(f"🐳 Pulling Docker image: {docker_image}")
-
-            # Pull the image first (in case it's not available locally)
-            pull_cmd = ["docker", "pull", docker_image]
-            pull_result = subprocess.run(pull_cmd, capture_output=True, text=True)
-
-            if pull_result.returncode != 0:
-                print(f"⚠️  Failed to pull Docker image: {pull_result.stderr}")
-                print("⚠️  Falling back to mock audit mode")
+            # The image is checked (and pulled if missing) once at startup
+            if not config.audit_image_ready:
+                log.warning("⚠️  Docker image not available: %s", DOCKER_IMAGE)
+                log.warning("⚠️  Falling back to mock audit mode")
                 return self._mock_audit_report(), spec_text
 
-            print("🔍 Running 42crunch audit via Docker...")
+            log.info("🔍 Running 42crunch audit via Docker...")
+            _start_groq_warm_up(config.groq_key)
 
             # Run the audit via Docker
             # The 42crunch image expects the API token as environment variable
@@ -190,52 +490,58 @@ class Audit42C(Node):
                 "-v",
                 f"{os.getcwd()}:/workspace",  # Mount current directory
                 "-e",
-                f"X42C_API_TOKEN={os.getenv('C42_TOKEN', '')}",
+                f"X42C_API_TOKEN={config.c42_token}",
                 "-e",
                 "X42C_REPOSITORY_URL=https://github.com/local/repo",
                 "-e",
                 "X42C_BRANCH_NAME=main",
                 "-e",
                 "X42C_PLATFORM_URL=https://platform.42crunch.com",
-                docker_image,
+                DOCKER_IMAGE,
             ]
 
-            audit_result = subprocess.run(docker_cmd, text=True, capture_output=True)
+            audit_proc = await asyncio.create_subprocess_exec(
+                *docker_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await audit_proc.communicate()
 
-            if audit_result.returncode != 0:
-                print(
-                    f"❌ Docker audit failed with return code: {audit_result.returncode}"
+            if audit_proc.returncode != 0:
+                log.error(
+                    "❌ Docker audit failed with return code: %s", audit_proc.returncode
                 )
-                print(f"❌ Docker stderr: {audit_result.stderr}")
-                print(f"❌ Docker stdout: {audit_result.stdout}")
-                print(f"❌ Docker command was: {' '.join(docker_cmd)}")
-                print("⚠️  Falling back to mock audit mode")
+                log.error("❌ Docker stderr: %s", stderr.decode(errors="replace"))
+                log.error("❌ Docker stdout: %s", stdout.decode(errors="replace"))
+                log.error("❌ Docker command was: %s", " ".join(docker_cmd))
+                log.warning("⚠️  Falling back to mock audit mode")
                 return self._mock_audit_report(), spec_text
 
             try:
-                report = json.loads(audit_result.stdout)
+                report = orjson.loads(stdout)
                 score = report.get("score", 0)
                 findings_count = len(report.get("findings", []))
 
-                print(f"📊 Audit Score: {score}/100")
-                print(f"🔍 Found {findings_count} security issues")
+                log.info("📊 Audit Score: %s/100", score)
+                log.info("🔍 Found %s security issues", findings_count)
 
+                self._audit_cache[cache_key] = report
                 return report, spec_text
 
-            except json.JSONDecodeError as e:
-                print(f"❌ Failed to parse Docker audit output: {e}")
-                print(f"❌ Raw output: {audit_result.stdout[:200]}...")
-                print("⚠️  Falling back to mock audit mode")
+            except orjson.JSONDecodeError as e:
+                log.error("❌ Failed to parse Docker audit output: %s", e)
+                log.error("❌ Raw output: %s...", stdout[:200].decode(errors="replace"))
+                log.warning("⚠️  Falling back to mock audit mode")
                 return self._mock_audit_report(), spec_text
 
         except Exception as e:
-            print(f"❌ Docker audit failed with error: {e}")
-            print("⚠️  Falling back to mock audit mode")
+            log.error("❌ Docker audit failed with error: %s", e)
+            log.warning("⚠️  Falling back to mock audit mode")
             return self._mock_audit_report(), spec_text
 
     def _mock_audit_report(self):
         """Generate a mock audit report for testing when CLI is not available"""
-        print("🎭 Generating mock security audit (score: 65/100)")
+        log.info("🎭 Generating mock security audit (score: 65/100)")
         return {
             "score": 65,
             "findings": [
@@ -260,7 +566,7 @@ class Audit42C(Node):
             ],
         }
 
-    def post(self, shared, _, out):
+    async def post_async(self, shared, _, out):
         # out should be a tuple (report, spec_text)
         if isinstance(out, tuple) and len(out) == 2:
             shared["report"] = out[0]
@@ -268,7 +574,7 @@ class Audit42C(Node):
         else:
             # Fallback - this shouldn't happen but just in case
             shared["report"] = out
-            print(
+            log.warning(
                 "⚠️  Warning: Expected tuple (report, spec_text) but got different format"
             )
 
@@ -277,37 +583,37 @@ class LLM_PlanPatch(Node):
     def prep(self, shared):
         report = shared["report"]
         spec_text = shared["spec_text"]
-        return report, spec_text
+        spec_format = shared.get("spec_format", "json")
+        return report, spec_text, spec_format, shared["config"]
 
     def exec(self, inputs):
-        report, spec_text = inputs
-        min_score = int(os.getenv("MIN_SCORE", 90))
+        report, spec_text, spec_format, config = inputs
+        min_score = config.min_score
 
         current_score = report.get("score", 0)
         if current_score >= min_score:
-            print(f"✅ Score {current_score} meets minimum {min_score} - Done!")
+            log.info("✅ Score %s meets minimum %s - Done!", current_score, min_score)
             return "done", []
 
         # Get top 3 most critical findings
         findings = report.get("findings", [])
         if not findings:
-            print("❌ No findings to fix but score is low")
+            log.error("❌ No findings to fix but score is low")
             return "done", []
 
-        top_findings = sorted(findings, key=lambda f: -f.get("severity", 0))[:3]
+        top_findings = heapq.nlargest(3, findings, key=lambda f: f.get("severity", 0))
 
-        print(f"🔧 Planning fixes for {len(top_findings)} critical issues...")
+        log.info("🔧 Planning fixes for %s critical issues...", len(top_findings))
         for i, finding in enumerate(top_findings, 1):
-            print(
-                f"  {i}. {finding.get('title', 'Unknown issue')} (severity: {finding.get('severity', 0)})"
+            log.info(
+                "  %s. %s (severity: %s)",
+                i,
+                finding.get("title", "Unknown issue"),
+                finding.get("severity", 0),
             )
 
-        # Use Groq instead of OpenAI
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError("GROQ_API_KEY environment variable is required")
-
-        client = Groq(api_key=groq_api_key)
+        # Use Groq instead of OpenAI (GROQ_API_KEY is validated at startup)
+        client = _groq_client(config.groq_key)
 
         # Create a focused prompt for the LLM
         issues_summary = []
@@ -324,224 +630,62 @@ class LLM_PlanPatch(Node):
         prompt = f"""You are an OpenAPI security expert. Fix the security issues in this OpenAPI specification.
 
 CURRENT OPENAPI SPEC:
-```yaml
+```{spec_format}
 {spec_text}
 ```
 
 SECURITY ISSUES TO FIX:
 {json.dumps(issues_summary, indent=2)}
-
-Generate a JSON Patch (RFC 6902) to fix these security issues. Common fixes include:
-- Adding security schemes (Bearer tokens, API keys)
-- Adding parameter validation (type, format, maxLength, etc.)
-- Adding proper response schemas
-- Adding rate limiting info
-- Fixing missing error responses
-
-Return ONLY a valid JSON Patch array, no explanations:
-[
-  {{"op": "add", "path": "/security", "value": [{{"bearerAuth": []}}]}},
-  {{"op": "add", "path": "/components/securitySchemes", "value": {{"bearerAuth": {{"type": "http", "scheme": "bearer"}}}}}}
-]"""
+{_PATCH_INSTRUCTIONS}"""
 
         try:
-            print("🤖 Asking LLM to generate security fixes...")
+            log.info("🤖 Asking LLM to generate security fixes...")
             response = client.chat.completions.create(
                 model="llama-3.1-8b-instant",
                 messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an OpenAPI security expert. Return only valid JSON Patch operations, no explanations.",
-                    },
+                    {"role": "system", "content": _SYSTEM_PROMPT},
                     {"role": "user", "content": prompt},
                 ],
                 temperature=0.1,
                 max_tokens=2000,
+                stream=True,
             )
 
-            patch_text = response.choices[0].message.content.strip()
-
-            # Clean up the response - extract JSON from markdown if needed
-            if "```json" in patch_text:
-                patch_text = patch_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in patch_text:
-                patch_text = patch_text.split("```")[1].split("```")[0].strip()
-
-            # Remove any leading/trailing text that isn't JSON
-            lines = patch_text.split("\n")
-            start_idx = 0
-            end_idx = len(lines)
-
-            for i, line in enumerate(lines):
-                if line.strip().startswith("["):
-                    start_idx = i
-                    break
+            patch_text = _read_patch_stream(response)
 
-            for i in range(len(lines) - 1, -1, -1):
-                if lines[i].strip().endswith("]"):
-                    end_idx = i + 1
-                    break
-
-            clean_patch = "\n".join(lines[start_idx:end_idx])
+            # Extract the JSON array, dropping markdown fences and surrounding text
+            clean_patch = _extract_patch_json(patch_text)
 
             patch_ops = json.loads(clean_patch)
-            print(f"🚀 Generated {len(patch_ops)} patch operations")
+            log.info("🚀 Generated %s patch operations", len(patch_ops))
 
             # Debug: Check the action being returned
             action = "patch"
-            print(
-                f"🔧 Debug: LLM_PlanPatch returning action: '{action}' with {len(patch_ops)} operations"
+            log.debug(
+                "🔧 LLM_PlanPatch returning action: '%s' with %s operations",
+                action,
+                len(patch_ops),
             )
             return action, patch_ops
 
         except json.JSONDecodeError as e:
-            print(f"❌ LLM returned invalid JSON: {patch_text}")
-            print(f"JSON Error: {e}")
+            log.error("❌ LLM returned invalid JSON: %s", patch_text)
+            log.error("JSON Error: %s", e)
             return "done", []  # Give up on this iteration
         except Exception as e:
-            print(f"❌ LLM request failed: {e}")
+            log.error("❌ LLM request failed: %s", e)
             return "done", []
 
     def post(self, shared, prep_result, exec_result):
         """Handle action routing for PocketFlow"""
-        print(f"🔧 Debug: LLM_PlanPatch.post called with exec_result: {exec_result}")
+        log.debug("🔧 LLM_PlanPatch.post called with exec_result: %s", exec_result)
         action_type, patch_ops = exec_result
-        print(f"🔧 Debug: LLM_PlanPatch.post returning action: '{action_type}'")
+        shared["patch_ops"] = patch_ops
+        log.debug("🔧 LLM_PlanPatch.post returning action: '%s'", action_type)
         return action_type
 
 
-class WritePatch(Node):
-    def prep(self, shared):
-        """Get data from shared state"""
-        print("🔧 Debug: WritePatch.prep called")
-        spec_text = shared.get("spec_text")
-        if not spec_text:
-            raise ValueError("No spec_text found in shared state")
-        return spec_text, shared
-
-    def exec(self, inputs):
-        """Apply the JSON patch to the OpenAPI spec"""
-        print(f"🔧 Debug: WritePatch.exec called with inputs: {type(inputs)}")
-        action_type, patch_ops = inputs
-
-        if action_type == "done":
-            print("✅ No patches needed - target score achieved!")
-            return "done"
-
-        if not patch_ops:
-            print("❌ No patch operations to apply")
-            return "no_changes"
-
-        # Return both action_type and patch_ops for processing in post()
-        print(
-            f"🔧 Debug: WritePatch.exec returning {action_type} with {len(patch_ops)} operations"
-        )
-        return action_type, patch_ops
-
-    def post(self, shared, prep_result, exec_result):
-        """Apply patches and save results"""
-        spec_text, shared_state = prep_result
-
-        # Handle different return types from exec
-        if exec_result in ["done", "no_changes"]:
-            return exec_result
-
-        # Unpack the tuple from exec
-        action_type, patch_ops = exec_result
-
-        try:
-            print(f"✏️  Applying {len(patch_ops)} patch operations...")
-
-            # Parse spec (handle both JSON and YAML)
-            if spec_text.strip().startswith("{"):
-                spec_json = json.loads(spec_text)
-                is_yaml = False
-            else:
-                spec_json = yaml.safe_load(spec_text)
-                is_yaml = True
-
-            # Apply patch
-            new_json = jsonpatch.apply_patch(spec_json, patch_ops)
-
-            # Write back in original format
-            if is_yaml:
-                new_text = yaml.safe_dump(
-                    new_json, sort_keys=False, default_flow_style=False
-                )
-            else:
-                new_text = json.dumps(new_json, indent=2)
-
-            # Update shared state with new spec text
-            shared["spec_text"] = new_text
-
-            # Debug: Check what's in shared_state
-            print(f"🔧 Debug: shared_state keys: {list(shared_state.keys())}")
-            print(
-                f"🔧 Debug: 'fastapi_project_dir' in shared_state: {'fastapi_project_dir' in shared_state}"
-            )
-
-            # Determine where to save the improved spec
-            if "fastapi_project_dir" in shared_state:
-                # For FastAPI projects, save the improved spec
-                print("🔧 Debug: Saving FastAPI improvements...")
-                self._save_fastapi_improvements(new_json, new_text, shared_state)
-            else:
-                # For direct spec files, update the original file
-                print("🔧 Debug: Saving spec file...")
-                self._save_spec_file(new_text)
-
-            print("🔄 Patches applied successfully - re-auditing...")
-            # Return action indicating completion for this iteration
-            return "complete"
-
-        except Exception as e:
-            print(f"❌ Patch application failed: {e}")
-            raise
-
-    def _save_fastapi_improvements(
-        self, improved_spec: dict, spec_text: str, shared_state: dict
-    ):
-        """Save improvements for FastAPI projects"""
-        project_dir = pathlib.Path(shared_state["fastapi_project_dir"])
-
-        # Save the improved OpenAPI spec
-        improved_spec_file = project_dir / "openapi_improved.yaml"
-        improved_spec_file.write_text(spec_text)
-        print(f"✅ Saved improved OpenAPI spec: {improved_spec_file}")
-
-        # Generate code suggestions
-        suggestions_file = project_dir / "security_improvements.md"
-        suggestions = self._generate_code_suggestions(improved_spec)
-        suggestions_file.write_text(suggestions)
-        print(f"📋 Generated improvement suggestions: {suggestions_file}")
-
-    def _save_spec_file(self, new_text: str):
-        """Save improved spec for direct spec files"""
-        spec_path = pathlib.Path(os.getenv("SPEC_PATH"))
-        backup_path = spec_path.with_suffix(f"{spec_path.suffix}.backup")
-
-        if backup_path.exists():
-            backup_path.unlink()  # Remove old backup
-
-        spec_path.rename(backup_path)
-        spec_path.write_text(new_text)
-
-        print(f"✅ Applied patch to {spec_path}")
-        print(f"📁 Backup saved as {backup_path}")
-
-    def _generate_code_suggestions(self, improved_spec: dict):
-        """Generate FastAPI code improvement suggestions"""
-        suggestions = """# FastAPI Security Improvements
-
-Based on the OpenAPI audit, here are suggested improvements for your FastAPI application:
-
-## 🔐 Security Enhancements Applied
-
-"""
-
-        # Check for security schemes
-        if "security" in improved_spec:
-            suggestions += """
+_AUTH_SUGGESTION = """
 ### 1. Authentication/Authorization
 The improved spec includes security schemes. Consider implementing:
 
@@ -569,9 +713,7 @@ async def protected_route():
 ```
 """
 
-        # Check for parameter validation improvements
-        if "components" in improved_spec and "schemas" in improved_spec["components"]:
-            suggestions += """
+_VALIDATION_SUGGESTION = """
 ### 2. Input Validation
 Enhanced parameter validation has been added. Update your Pydantic models:
 
@@ -591,8 +733,7 @@ class UserCreate(BaseModel):
 ```
 """
 
-        # Rate limiting suggestions
-        suggestions += """
+_RATE_LIMIT_SUGGESTION = """
 ### 3. Rate Limiting
 Consider adding rate limiting to your endpoints:
 
@@ -612,8 +753,7 @@ async def get_users(request: Request):
 ```
 """
 
-        # CORS and security headers
-        suggestions += """
+_SECURITY_HEADERS_SUGGESTION = """
 ### 4. Security Headers & CORS
 Add security middleware:
 
@@ -644,10 +784,28 @@ async def add_security_headers(request: Request, call_next):
 ```
 """
 
-        suggestions += """
+# Only the auth and validation sections depend on what the patched spec contains
+_SUGGESTION_DEFAULTS = {
+    "auth_block": "",
+    "validation_block": "",
+    "rate_limit_block": _RATE_LIMIT_SUGGESTION,
+    "security_headers_block": _SECURITY_HEADERS_SUGGESTION,
+}
+
+# Layout of security_improvements.md, filled with str.format_map
+_SUGGESTIONS_TEMPLATE = (
+    """# FastAPI Security Improvements
+
+Based on the OpenAPI audit, here are suggested improvements for your FastAPI application:
+
+## 🔐 Security Enhancements Applied
+
+"""
+    "{auth_block}{validation_block}{rate_limit_block}{security_headers_block}"
+    """
 ## 🔄 Next Steps
 
-1. Review the improved OpenAPI spec in `openapi_improved.yaml`
+1. Review the improved OpenAPI spec in `openapi_improved.json`
 2. Implement the security enhancements above
 3. Test your API with the new security measures
 4. Run the audit again to verify improvements
@@ -658,5 +816,128 @@ async def add_security_headers(request: Request, call_next):
 - [OWASP API Security Top 10](https://owasp.org/www-project-api-security/)
 - [42Crunch Security Guidelines](https://docs.42crunch.com/latest/openapi-security/)
 """
+)
+
+
+class WritePatch(Node):
+    def prep(self, shared):
+        """Get data from shared state"""
+        log.debug("🔧 WritePatch.prep called")
+        if shared.get("spec_dict") is None:
+            raise ValueError("No spec_dict found in shared state")
+        return "patch", shared.get("patch_ops", [])
+
+    def exec(self, inputs):
+        """Apply the JSON patch to the OpenAPI spec"""
+        log.debug("🔧 WritePatch.exec called with inputs: %s", type(inputs))
+        action_type, patch_ops = inputs
+
+        if action_type == "done":
+            log.info("✅ No patches needed - target score achieved!")
+            return "done"
+
+        if not patch_ops:
+            log.error("❌ No patch operations to apply")
+            return "no_changes"
+
+        # Return both action_type and patch_ops for processing in post()
+        log.debug(
+            "🔧 WritePatch.exec returning %s with %s operations",
+            action_type,
+            len(patch_ops),
+        )
+        return action_type, patch_ops
+
+    def post(self, shared, prep_result, exec_result):
+        """Apply patches and save results"""
+        # Handle different return types from exec
+        if exec_result in ["done", "no_changes"]:
+            return exec_result
+
+        # Unpack the tuple from exec
+        action_type, patch_ops = exec_result
+
+        try:
+            log.info("✏️  Applying %s patch operations...", len(patch_ops))
+            old_hash = shared.get("spec_hash") or _spec_digest(shared["spec_dict"])
+
+            # Apply patch in place on the already-parsed spec (no deep copy)
+            new_json = _apply_patch_ops(shared["spec_dict"], patch_ops)
+
+            # A no-op patch means the model has converged, re-auditing won't help
+            new_hash = _spec_digest(new_json)
+            shared["spec_hash"] = new_hash
+            if new_hash == old_hash:
+                log.warning("⚠️  Patch left the spec unchanged - stopping")
+                return "done"
+
+            # Serialize once, in the original format (YAML only for direct YAML files)
+            if shared.get("spec_format") == "yaml":
+                new_text = yaml.dump(
+                    new_json,
+                    Dumper=_YDumper,
+                    sort_keys=False,
+                    default_flow_style=False,
+                )
+            else:
+                new_text = orjson.dumps(new_json, option=orjson.OPT_INDENT_2).decode()
+
+            # Update shared state with the new spec
+            shared["spec_dict"] = new_json
+            shared["spec_text"] = new_text
+
+            # Debug: Check what's in shared state
+            log.debug("🔧 shared keys: %s", list(shared.keys()))
+            log.debug(
+                "🔧 'fastapi_project_dir' in shared: %s",
+                "fastapi_project_dir" in shared,
+            )
+
+            # Determine where to save the improved spec
+            if "fastapi_project_dir" in shared:
+                # For FastAPI projects, save the improved spec
+                log.debug("🔧 Saving FastAPI improvements...")
+                self._save_fastapi_improvements(new_json, new_text, shared)
+            else:
+                # For direct spec files, the original is rewritten once at the end
+                log.debug("🔧 Deferring spec file write until the run finishes")
+                shared["final_spec_text"] = new_text
+
+            log.info("🔄 Patches applied successfully - re-auditing...")
+            # Return action indicating completion for this iteration
+            return "complete"
+
+        except Exception as e:
+            log.error("❌ Patch application failed: %s", e)
+            raise
+
+    def _save_fastapi_improvements(
+        self, improved_spec: dict, spec_text: str, shared_state: dict
+    ):
+        """Save improvements for FastAPI projects"""
+        project_dir = pathlib.Path(shared_state["fastapi_project_dir"])
+
+        # Save the improved OpenAPI spec
+        improved_spec_file = project_dir / "openapi_improved.json"
+        improved_spec_file.write_text(spec_text, encoding="utf-8")
+        log.info("✅ Saved improved OpenAPI spec: %s", improved_spec_file)
+
+        # Generate code suggestions
+        suggestions_file = project_dir / "security_improvements.md"
+        suggestions = self._generate_code_suggestions(improved_spec)
+        suggestions_file.write_text(suggestions, encoding="utf-8")
+        log.info("📋 Generated improvement suggestions: %s", suggestions_file)
+
+    def _generate_code_suggestions(self, improved_spec: dict):
+        """Generate FastAPI code improvement suggestions"""
+        blocks = {}
+
+        # Check for security schemes
+        if "security" in improved_spec:
+            blocks["auth_block"] = _AUTH_SUGGESTION
+
+        # Check for parameter validation improvements
+        if "components" in improved_spec and "schemas" in improved_spec["components"]:
+            blocks["validation_block"] = _VALIDATION_SUGGESTION
 
-        return suggestions
+        return _SUGGESTIONS_TEMPLATE.format_map(ChainMap(blocks, _SUGGESTION_DEFAULTS))
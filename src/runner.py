@@ -1,11 +1,47 @@
 # runner.py
-import os
+import asyncio
+import dataclasses
+import logging
 import pathlib
+import shutil
+import subprocess
+import sys
 
 import dotenv
-from pocketflow import Flow
-
-from nodes import Audit42C, LLM_PlanPatch, LoadSpec, WritePatch
+from pocketflow import AsyncFlow
+
+from config import Config
+from nodes import (
+    DOCKER_IMAGE,
+    Audit42C,
+    LLM_PlanPatch,
+    LoadSpec,
+    WritePatch,
+    save_final_spec,
+)
+
+log = logging.getLogger("nemesis")
+
+
+def _prepare_audit_image():
+    """Make sure the 42crunch Docker image is present, pulling it only if missing"""
+    # The local CLI takes precedence over Docker, and without Docker we mock
+    if shutil.which("42c-audit") or not shutil.which("docker"):
+        return False
+
+    inspect_cmd = ["docker", "image", "inspect", DOCKER_IMAGE]
+    if subprocess.run(inspect_cmd, capture_output=True).returncode == 0:
+        log.info("🐳 Docker image available: %s", DOCKER_IMAGE)
+        return True
+
+    log.info("🐳 Pulling Docker image: %s", DOCKER_IMAGE)
+    pull_result = subprocess.run(
+        ["docker", "pull", DOCKER_IMAGE], capture_output=True, text=True
+    )
+    if pull_result.returncode != 0:
+        log.warning("⚠️  Failed to pull Docker image: %s", pull_result.stderr)
+        return False
+    return True
 
 
 def main():
@@ -15,23 +51,32 @@ def main():
     env_path = project_root / ".env"
     dotenv.load_dotenv(env_path)
 
-    # Configuration
-    os.environ.setdefault("MIN_SCORE", "90")
-    spec_path = os.getenv("SPEC_PATH", "./sample_api.yaml")
-
-    # Debug prints
-    print(f"🔧 Debug: spec_path = {repr(spec_path)}")
-    print(f"🔧 Debug: spec_path type = {type(spec_path)}")
+    # Configuration (read once, shared with every node)
+    config = Config.from_env()
+    # Only our own logger prints; httpx & co. stay at the root's WARNING level
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+        log.propagate = False
+    log.setLevel(config.log_level)
+    spec_path = config.spec_path
+
+    # Debug logging (set LOG_LEVEL=DEBUG to see it)
+    log.debug("🔧 spec_path = %r", spec_path)
+    log.debug("🔧 spec_path type = %s", type(spec_path))
 
     # Validate environment
-    if not os.getenv("C42_TOKEN"):
+    if not config.c42_token:
         raise ValueError("C42_TOKEN environment variable is required")
-    if not os.getenv("GROQ_API_KEY"):
+    if not config.groq_key:
         raise ValueError("GROQ_API_KEY environment variable is required")
 
-    print(f"📄 Target spec: {spec_path}")
-    print(f"🎯 Target score: {os.getenv('MIN_SCORE')}")
-    print("-" * 50)
+    config = dataclasses.replace(config, audit_image_ready=_prepare_audit_image())
+
+    log.info("📄 Target spec: %s", spec_path)
+    log.info("🎯 Target score: %s", config.min_score)
+    log.info("-" * 50)
 
     # Create nodes
     load = LoadSpec()
@@ -48,26 +93,24 @@ def main():
     # Note: The flow ends naturally when decide returns "done" action without any connected node
 
     # Run the flow
-    flow = Flow(start=load)
+    flow = AsyncFlow(start=load)
 
-    print("🚀 Starting OpenAPI Security Enhancement Agent...")
+    log.info("🚀 Starting OpenAPI Security Enhancement Agent...")
 
     # Create shared state dictionary
     shared_state = {
         "spec_path": spec_path,
-        "min_score": int(os.getenv("MIN_SCORE", 90)),
+        "config": config,
     }
-    print(f"🔧 Debug: About to call flow.run() with {repr(shared_state)}")
+    log.debug("🔧 About to call flow.run_async() with %r", shared_state)
 
     try:
-        result = flow.run(shared_state)
-        print("\n✅ Process completed successfully!")
+        result = asyncio.run(flow.run_async(shared_state))
+        save_final_spec(shared_state)
+        log.info("\n✅ Process completed successfully!")
         return result
-    except Exception as e:
-        print(f"❌ Agent failed: {e}")
-        import traceback
-
-        traceback.print_exc()
+    except Exception:
+        log.exception("❌ Agent failed")
         raise
 
 
@@ -0,0 +1,116 @@
+import copy
+import json
+from types import SimpleNamespace
+
+import jsonpatch
+import pytest
+
+from nodes import _apply_patch_ops, _extract_patch_json, _read_patch_stream
+
+PATCH = (
+    '[{"op": "remove", "path": "/x"}, {"op": "add", "path": "/y", "value": "a]\\"["}]'
+)
+
+
+class FakeStream:
+    """Groq-style completion stream that hands out the reply in fixed-size chunks"""
+
+    def __init__(self, text, size):
+        self.chunks = [text[i : i + size] for i in range(0, len(text), size)]
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.chunks:
+            self.read += 1
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))]
+            )
+
+    def close(self):
+        self.closed = True
+
+
+REPLIES = [
+    f"```json\n{PATCH}\n```",
+    f"Here is the JSON Patch [RFC 6902] to apply:\n```json\n{PATCH}\n```\nsee [1]",
+    f"Setting security to [] disables auth. Fix:\n```json\n{PATCH}\n```",
+    f'Format is [{{"op": "..."}}]. Here:\n```json\n{PATCH}```',
+    f"Sure: {PATCH} done",
+    f"Patch [RFC 6902]: {PATCH}",
+]
+
+
+@pytest.mark.parametrize("reply", REPLIES)
+@pytest.mark.parametrize("size", [1, 3, 4, 1000])
+def test_read_patch_stream_finds_patch(reply, size):
+    stream = FakeStream(reply, size)
+    text = _read_patch_stream(stream)
+
+    assert json.loads(_extract_patch_json(text)) == json.loads(PATCH)
+    assert stream.closed
+
+
+def test_read_patch_stream_stops_after_fenced_array():
+    stream = FakeStream(f"```json\n{PATCH}\n```\n" + "trailing prose " * 50, 1)
+    assert _read_patch_stream(stream).endswith(PATCH)
+    assert stream.read < len(stream.chunks)
+
+
+def test_read_patch_stream_reads_unfenced_reply_to_the_end():
+    reply = f"Sure: {PATCH} done"
+    stream = FakeStream(reply, 1)
+    assert _read_patch_stream(stream) == reply
+
+
+DOC = {
+    "paths": {"/a~b": {"get": {"tags": ["x", "y"]}}, "/c/d": {}},
+    "list": [1, 2, 3],
+}
+
+
+@pytest.mark.parametrize(
+    "op",
+    [
+        {"op": "add", "path": "/security", "value": [{"bearerAuth": []}]},
+        {"op": "add", "path": "/paths/~1a~0b/get/tags/1", "value": "z"},
+        {"op": "add", "path": "/paths/~1a~0b/get/tags/-", "value": "z"},
+        {"op": "replace", "path": "/list/0", "value": 9},
+        {"op": "remove", "path": "/paths/~1c~1d"},
+        {"op": "remove", "path": "/list/2"},
+        {"op": "move", "from": "/list", "path": "/moved"},
+        {"op": "replace", "path": "", "value": {"new": True}},
+    ],
+)
+def test_apply_patch_ops_matches_jsonpatch(op):
+    expected = jsonpatch.apply_patch(copy.deepcopy(DOC), [op])
+    assert _apply_patch_ops(copy.deepcopy(DOC), [op]) == expected
+
+
+@pytest.mark.parametrize(
+    "op",
+    [
+        {"op": "replace", "path": "/missing", "value": 1},
+        {"op": "remove", "path": "/list/3"},
+        {"op": "remove", "path": "/list/01"},
+        {"op": "add", "path": "/list/5", "value": 1},
+        {"op": "add", "path": "/missing/child", "value": 1},
+    ],
+)
+def test_apply_patch_ops_rejects_bad_paths(op):
+    with pytest.raises(Exception) as expected:
+        jsonpatch.apply_patch(copy.deepcopy(DOC), [op])
+    with pytest.raises(expected.type):
+        _apply_patch_ops(copy.deepcopy(DOC), [op])
+
+
+@pytest.mark.parametrize(
+    "reply",
+    [
+        f"Setting security to [] disables auth. Fix:\n{PATCH}",
+        f'Use [1, 2] or [["a"]] style; patch: {PATCH} [done]',
+        f"```\n{PATCH}\n```",
+    ],
+)
+def test_extract_patch_json_skips_non_patch_brackets(reply):
+    assert json.loads(_extract_patch_json(reply)) == json.loads(PATCH)